@@ -5,7 +5,8 @@ from fastapi import APIRouter, Depends, HTTPException, Form
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy import select
 from passlib.context import CryptContext
-from database import new_session, UserOrm, LinkOrm
+from database import new_session, link_shards, UserOrm, LinkOrm
+from sharding import Shard
 from schemas import UserRegister, UserResponse
 
 logger = logging.getLogger(__name__)
@@ -86,21 +87,25 @@ class AuthService:
         """
         Обновление user_id для всех ссылок, созданных до авторизации.
         """
-        async with new_session() as session:
-            try:
-                query = select(LinkOrm).where(LinkOrm.user_id.is_(None))
-                result = await session.execute(query)
-                links = result.scalars().all()
-
-                for link in links:
-                    link.user_id = user_id
-
-                await session.commit()
-                logger.info(f"Updated user_id for {len(links)} links")
-            except Exception as e:
-                logger.error(f"Error updating user_id for links: {e}")
-                await session.rollback()
-                raise HTTPException(status_code=500, detail="Internal Server Error")
+        async def update_in_shard(shard: Shard) -> int:
+            async with shard.session() as session:
+                try:
+                    query = select(LinkOrm).where(LinkOrm.user_id.is_(None))
+                    result = await session.execute(query)
+                    links = result.scalars().all()
+
+                    for link in links:
+                        link.user_id = user_id
+
+                    await session.commit()
+                    return len(links)
+                except Exception as e:
+                    logger.error(f"Error updating user_id for links: shard={shard.index}, {e}")
+                    await session.rollback()
+                    raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        updated = await link_shards.gather(update_in_shard)
+        logger.info(f"Updated user_id for {sum(updated)} links")
 
 
 @auth_router.post("/register")
@@ -2,11 +2,29 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from datetime import datetime, timedelta
 from typing import Optional
+from sharding import ShardRouter
+import os
 
 
 engine = create_async_engine("sqlite+aiosqlite:///links.db")
 new_session = async_sessionmaker(engine, expire_on_commit=False)
 
+# Ссылки можно разнести по нескольким БД, например:
+# LINK_SHARD_URLS="sqlite+aiosqlite:///links_0.db,sqlite+aiosqlite:///links_1.db"
+# Без настройки все ссылки хранятся в основной БД вместе с пользователями.
+LINK_SHARD_URLS = [url.strip() for url in os.getenv("LINK_SHARD_URLS", "").split(",") if url.strip()]
+LINK_SHARDS_REBALANCING = os.getenv("LINK_SHARDS_REBALANCING") == "1"
+
+if LINK_SHARD_URLS:
+    link_shards = ShardRouter.from_urls(LINK_SHARD_URLS, fallback=LINK_SHARDS_REBALANCING)
+else:
+    link_shards = ShardRouter([engine])
+
+# Без шардов база очищается при каждом запуске, с шардами данные сохраняются.
+# Пользователи и ссылки очищаются только вместе, иначе новый пользователь
+# получит id старого вместе с его ссылками.
+RESET_TABLES = os.getenv("RESET_TABLES", "0" if LINK_SHARD_URLS else "1") == "1"
+
 
 class Model(DeclarativeBase):
     pass
@@ -36,8 +54,27 @@ class LinkOrm(Model):
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Model.metadata.create_all)
+    await create_link_tables()
 
 
 async def delete_tables():
     async with engine.begin() as conn:
-        await conn.run_sync(Model.metadata.drop_all)
\ No newline at end of file
+        await conn.run_sync(Model.metadata.drop_all)
+    await link_shards.gather(_drop_link_table)
+
+
+async def create_link_tables():
+    """
+    Создание таблицы ссылок на шардах, где ее еще нет.
+    """
+    await link_shards.gather(_create_link_table)
+
+
+async def _create_link_table(shard):
+    async with shard.engine.begin() as conn:
+        await conn.run_sync(Model.metadata.create_all, tables=[LinkOrm.__table__])
+
+
+async def _drop_link_table(shard):
+    async with shard.engine.begin() as conn:
+        await conn.run_sync(Model.metadata.drop_all, tables=[LinkOrm.__table__])
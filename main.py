@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
-from database import create_tables, delete_tables
+from database import create_tables, delete_tables, RESET_TABLES
 from router import router as links_router
 from auth import auth_router
 from contextlib import asynccontextmanager
@@ -14,8 +14,9 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await delete_tables()
-    logger.info("База очищена")
+    if RESET_TABLES:
+        await delete_tables()
+        logger.info("База очищена")
     await create_tables()
     logger.info("База готова к работе")
 
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Optional
+from sqlalchemy import select, delete
+from database import link_shards, create_link_tables, LinkOrm
+from sharding import Shard
+
+logger = logging.getLogger(__name__)
+
+MOVE_ATTEMPTS = 5
+MOVE_BACKOFF = 0.1
+
+LINK_FIELDS = ("original_url", "short_code", "created_at", "expires_at", "user_id", "click_count", "last_used_at")
+
+
+def link_values(link: LinkOrm) -> dict:
+    # id не переносим: на целевом шарде у него своя последовательность.
+    return {field: getattr(link, field) for field in LINK_FIELDS}
+
+
+async def get_link(shard: Shard, link_id: int) -> Optional[LinkOrm]:
+    async with shard.session() as session:
+        return await session.get(LinkOrm, link_id)
+
+
+async def write_copy(target: Shard, link: LinkOrm):
+    """
+    Запись копии ссылки на целевой шард.
+    Копия от прерванного переноса перезаписывается: пока ссылка лежит на старом шарде,
+    сервис меняет только ее, поэтому копия могла устареть.
+    Копия узнается по короткому коду и времени создания.
+    """
+    async with target.session() as session:
+        query = select(LinkOrm).where(LinkOrm.short_code == link.short_code)
+        existing = (await session.execute(query)).scalars().all()
+        for other in existing:
+            if other.created_at != link.created_at:
+                raise RuntimeError(
+                    f"Shard {target.index} already has another link with short_code={link.short_code}"
+                )
+
+        if existing:
+            for field, value in link_values(link).items():
+                setattr(existing[0], field, value)
+        else:
+            session.add(LinkOrm(**link_values(link)))
+        await session.commit()
+
+
+async def move_link(source: Shard, target: Shard, link: LinkOrm) -> bool:
+    """
+    Перенос одной ссылки.
+    Ссылка удаляется со старого шарда, только если не менялась с момента копирования,
+    иначе копия обновляется и попытка повторяется. Если ссылка меняется слишком часто,
+    она остается на старом шарде до следующего запуска.
+    """
+    for attempt in range(MOVE_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(MOVE_BACKOFF * 2 ** (attempt - 1))
+
+        current = await get_link(source, link.id)
+        if current is None:
+            # Ссылку удалил сервис, пока ее переносили: копия тоже не нужна.
+            async with target.session() as session:
+                await session.execute(delete(LinkOrm).where(
+                    (LinkOrm.short_code == link.short_code) & (LinkOrm.created_at == link.created_at)
+                ))
+                await session.commit()
+            return False
+
+        await write_copy(target, current)
+
+        async with source.session() as session:
+            conditions = [LinkOrm.id == current.id]
+            conditions += [getattr(LinkOrm, field) == value for field, value in link_values(current).items()]
+            result = await session.execute(delete(LinkOrm).where(*conditions))
+            await session.commit()
+
+        if result.rowcount:
+            return True
+        logger.debug(f"Link changed during move, retrying: short_code={link.short_code}")
+
+    logger.warning(f"Link keeps changing, skipped until next run: short_code={link.short_code}")
+    return False
+
+
+async def rebalance_shard(shard: Shard, batch_size: int = 500) -> int:
+    """
+    Перенос с шарда всех ссылок, которые по хешу принадлежат другим шардам.
+    """
+    moved = 0
+    last_id = 0
+    while True:
+        async with shard.session() as session:
+            query = select(LinkOrm).where(LinkOrm.id > last_id).order_by(LinkOrm.id).limit(batch_size)
+            batch = (await session.execute(query)).scalars().all()
+
+        if not batch:
+            return moved
+        last_id = batch[-1].id
+
+        for link in batch:
+            target = link_shards.shard_for(link.short_code)
+            if target is not shard and await move_link(shard, target, link):
+                moved += 1
+
+        logger.info(f"Shard {shard.index}: moved {moved} links")
+
+
+async def rebalance_links(batch_size: int = 500) -> int:
+    """
+    Ребалансировка ссылок после изменения LINK_SHARD_URLS.
+    Сервис на время переноса запускается с LINK_SHARDS_REBALANCING=1.
+    """
+    await create_link_tables()
+    moved = await link_shards.gather(lambda shard: rebalance_shard(shard, batch_size))
+    logger.info(f"Rebalance finished, moved {sum(moved)} links")
+    return sum(moved)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(rebalance_links())
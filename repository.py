@@ -2,10 +2,11 @@ import secrets
 import string
 from fastapi import HTTPException
 from sqlalchemy import select, update, delete
-from database import new_session, LinkOrm
+from database import link_shards, LinkOrm
+from sharding import Shard
 from schemas import SLinkAdd, SLinkResponse
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional, Tuple
 import asyncio
 import logging
 from urllib.parse import unquote
@@ -27,30 +28,84 @@ class LinkRepository:
         return ''.join(secrets.choice(chars) for _ in range(length))
 
 
+    @staticmethod
+    async def _get_from_shard(shard: Shard, short_code: str) -> Optional[LinkOrm]:
+        async with shard.session() as session:
+            query = select(LinkOrm).where(LinkOrm.short_code == short_code)
+            result = await session.execute(query)
+            return result.scalars().first()
+
+
+    @classmethod
+    async def locate(cls, short_code: str) -> Tuple[Shard, Optional[LinkOrm]]:
+        """
+        Поиск шарда, на котором лежит ссылка.
+        """
+        shard = link_shards.shard_for(short_code)
+        if not link_shards.fallback:
+            return shard, await cls._get_from_shard(shard, short_code)
+
+        # Во время ребалансировки ссылка, еще не удаленная со старого шарда,
+        # главнее своей копии: все изменения идут туда, пока ее не перенесут.
+        # Копия пишется до удаления оригинала, поэтому целевой шард читается
+        # последним: если оригинал успели удалить, копия уже на месте.
+        others = [other for other in link_shards.shards if other is not shard]
+        links = await asyncio.gather(*(cls._get_from_shard(other, short_code) for other in others))
+        for other_shard, other_link in zip(others, links):
+            if other_link:
+                return other_shard, other_link
+        return shard, await cls._get_from_shard(shard, short_code)
+
+
+    @classmethod
+    async def _execute_on_link(
+        cls,
+        short_code: str,
+        make_query: Callable[[LinkOrm], object],
+        shard: Optional[Shard] = None,
+        link: Optional[LinkOrm] = None,
+    ) -> int:
+        """
+        Запрос к ссылке на ее шарде.
+        Если ссылку перенесли между поиском и запросом, запрос повторяется на новом шарде.
+        """
+        if link is None:
+            shard, link = await cls.locate(short_code)
+        for _ in range(2):
+            if link is None:
+                return 0
+            async with shard.session() as session:
+                result = await session.execute(make_query(link))
+                await session.commit()
+            if result.rowcount or not link_shards.fallback:
+                return result.rowcount
+            shard, link = await cls.locate(short_code)
+        return 0
+
+
     @classmethod
     async def add_one(cls, data: SLinkAdd, user_id: Optional[int] = None) -> SLinkResponse:
         """
         Добавление новой ссылки в БД.
         """
-        async with new_session() as session:
+        if data.custom_alias:
+            existing_link = await cls.find_by_short_code(data.custom_alias)
+            if existing_link:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Пользовательский алиас уже занят."
+                )
+            short_code = data.custom_alias
+        else:
+            while True:
+                short_code = cls.generate_short_code()
+                existing_link = await cls.find_by_short_code(short_code)
+                if not existing_link:
+                    break
+
+        async with link_shards.shard_for(short_code).session() as session:
             try:
                 normalized_url = normalize_url(str(data.original_url))
-
-                if data.custom_alias:
-                    existing_link = await cls.find_by_short_code(data.custom_alias)
-                    if existing_link:
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Пользовательский алиас уже занят."
-                        )
-                    short_code = data.custom_alias
-                else:
-                    while True:
-                        short_code = cls.generate_short_code()
-                        existing_link = await cls.find_by_short_code(short_code)
-                        if not existing_link:
-                            break
-
                 expires_at = data.expires_at if data.expires_at else datetime.utcnow() + timedelta(days=30)
 
                 link = LinkOrm(
@@ -87,10 +142,8 @@ class LinkRepository:
         """
         Поиск по короткому коду.
         """
-        async with new_session() as session:
-            query = select(LinkOrm).where(LinkOrm.short_code == short_code)
-            result = await session.execute(query)
-            return result.scalars().first()
+        _, link = await cls.locate(short_code)
+        return link
 
 
     @classmethod
@@ -98,32 +151,36 @@ class LinkRepository:
         """
         Поиск по оригинальному URL.
         """
-        async with new_session() as session:
-            normalized_url = normalize_url(original_url)
-            logger.debug(f"Normalized URL: {normalized_url}")
-
-            query = select(LinkOrm).where(LinkOrm.original_url == normalized_url)
-            result = await session.execute(query)
-            link = result.scalars().first()
-
-            if link:
-                logger.debug(f"Found link: {link.original_url}")
-            else:
-                logger.debug("Link not found")
-
-            if not link:
-                return None
-
-            return SLinkResponse(
-                id=link.id,
-                original_url=link.original_url,
-                short_code=link.short_code,
-                created_at=link.created_at,
-                expires_at=link.expires_at,
-                user_id=link.user_id,
-                click_count=link.click_count,
-                short_url=f"http://127.0.0.1:8000/links/{link.short_code}",
-            )
+        normalized_url = normalize_url(original_url)
+        logger.debug(f"Normalized URL: {normalized_url}")
+
+        async def find_in_shard(shard: Shard) -> Optional[LinkOrm]:
+            async with shard.session() as session:
+                query = select(LinkOrm).where(LinkOrm.original_url == normalized_url)
+                result = await session.execute(query)
+                return result.scalars().first()
+
+        links = [link for link in await link_shards.gather(find_in_shard) if link]
+        link = min(links, key=lambda l: l.created_at) if links else None
+
+        if link:
+            logger.debug(f"Found link: {link.original_url}")
+        else:
+            logger.debug("Link not found")
+
+        if not link:
+            return None
+
+        return SLinkResponse(
+            id=link.id,
+            original_url=link.original_url,
+            short_code=link.short_code,
+            created_at=link.created_at,
+            expires_at=link.expires_at,
+            user_id=link.user_id,
+            click_count=link.click_count,
+            short_url=f"http://127.0.0.1:8000/links/{link.short_code}",
+        )
 
 
     @classmethod
@@ -131,12 +188,10 @@ class LinkRepository:
         """
         Удаление ссылки по короткому коду.
         """
-        async with new_session() as session:
-            query = delete(LinkOrm).where(
-                (LinkOrm.short_code == short_code) & (LinkOrm.user_id == user_id)
-            )
-            await session.execute(query)
-            await session.commit()
+        await cls._execute_on_link(
+            short_code,
+            lambda link: delete(LinkOrm).where((LinkOrm.id == link.id) & (LinkOrm.user_id == user_id)),
+        )
 
 
     @classmethod
@@ -144,52 +199,55 @@ class LinkRepository:
         """
         Обновление оригинального URL.
         """
-        async with new_session() as session:
-            try:
-                normalized_url = normalize_url(new_url)
-
-                query = update(LinkOrm).where(
-                    (LinkOrm.short_code == short_code) & (LinkOrm.user_id == user_id)
-                ).values(original_url=normalized_url)
-                await session.execute(query)
-                await session.commit()
-
-                updated_link = await cls.find_by_short_code(short_code)
-                if not updated_link:
-                    logger.error(f"Failed to fetch updated link: short_code={short_code}")
-                    return None
+        try:
+            normalized_url = normalize_url(new_url)
+
+            await cls._execute_on_link(
+                short_code,
+                lambda link: update(LinkOrm).where(
+                    (LinkOrm.id == link.id) & (LinkOrm.user_id == user_id)
+                ).values(original_url=normalized_url),
+            )
 
-                return updated_link
-            except Exception as e:
-                logger.error(f"Error updating link in database: {e}")
-                await session.rollback()
+            updated_link = await cls.find_by_short_code(short_code)
+            if not updated_link:
+                logger.error(f"Failed to fetch updated link: short_code={short_code}")
                 return None
 
+            return updated_link
+        except Exception as e:
+            logger.error(f"Error updating link in database: {e}")
+            return None
+
 
     @classmethod
-    async def increment_click_count(cls, link_id: int):
+    async def increment_click_count(cls, shard: Shard, link: LinkOrm):
         """
         Счетчик переходов по ссылке.
         """
-        async with new_session() as session:
-            query = update(LinkOrm).where(LinkOrm.id == link_id).values(click_count=LinkOrm.click_count + 1)
-            await session.execute(query)
-            await session.commit()
+        await cls._execute_on_link(
+            link.short_code,
+            lambda link: update(LinkOrm).where(LinkOrm.id == link.id).values(click_count=LinkOrm.click_count + 1),
+            shard=shard,
+            link=link,
+        )
 
 
 async def delete_expired_links():
     """
     Фоновая задача для удаления истекших ссылок.
     """
-    while True:
-        async with new_session() as session:
+    async def delete_in_shard(shard: Shard):
+        async with shard.session() as session:
             try:
                 query = delete(LinkOrm).where(LinkOrm.expires_at < datetime.utcnow())
                 await session.execute(query)
                 await session.commit()
-                logger.info("Expired links deleted")
+                logger.info(f"Expired links deleted: shard={shard.index}")
             except Exception as e:
-                logger.error(f"Error deleting expired links: {e}")
+                logger.error(f"Error deleting expired links: shard={shard.index}, {e}")
                 await session.rollback()
 
+    while True:
+        await link_shards.gather(delete_in_shard)
         await asyncio.sleep(1800)
\ No newline at end of file
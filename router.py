@@ -67,11 +67,11 @@ async def redirect_link(short_code: str):
     """
     Перенаправление на оригинальный URL по короткой ссылке.
     """
-    link = await LinkRepository.find_by_short_code(short_code)
+    shard, link = await LinkRepository.locate(short_code)
     if not link:
         raise HTTPException(status_code=404, detail="Ссылка не найдена")
 
-    await LinkRepository.increment_click_count(link.id)
+    await LinkRepository.increment_click_count(shard, link)
     return RedirectResponse(url=link.original_url)
 
 
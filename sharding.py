@@ -0,0 +1,56 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, List, Sequence, TypeVar
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+
+T = TypeVar("T")
+
+
+class Shard:
+    def __init__(self, index: int, engine: AsyncEngine):
+        self.index = index
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+
+    def __repr__(self) -> str:
+        return f"Shard({self.index}, {self.engine.url})"
+
+
+class ShardRouter:
+    """
+    Маршрутизация ссылок по шардам по хешу короткого кода.
+
+    Используется rendezvous-хеширование: при добавлении шарда на него
+    переезжает только часть ссылок, остальные остаются на месте.
+    """
+
+    def __init__(self, engines: Sequence[AsyncEngine], fallback: bool = False):
+        if not engines:
+            raise ValueError("Нужен хотя бы один шард")
+        self.shards = [Shard(index, engine) for index, engine in enumerate(engines)]
+        # Во время ребалансировки ссылка может еще лежать на старом шарде,
+        # поэтому ищем ее на всех шардах.
+        self.fallback = fallback
+
+    @classmethod
+    def from_urls(cls, urls: Sequence[str], fallback: bool = False, **engine_kwargs) -> "ShardRouter":
+        return cls([create_async_engine(url, **engine_kwargs) for url in urls], fallback=fallback)
+
+    @staticmethod
+    def _weight(index: int, short_code: str) -> int:
+        digest = hashlib.sha256(f"{index}:{short_code}".encode()).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def shard_for(self, short_code: str) -> Shard:
+        """
+        Шард, на котором должна храниться ссылка.
+        """
+        if len(self.shards) == 1:
+            return self.shards[0]
+        return max(self.shards, key=lambda shard: self._weight(shard.index, short_code))
+
+    async def gather(self, func: Callable[[Shard], Awaitable[T]]) -> List[T]:
+        """
+        Параллельный запуск запроса на всех шардах.
+        """
+        return list(await asyncio.gather(*(func(shard) for shard in self.shards)))
@@ -0,0 +1,341 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+import auth
+import database
+import main
+import rebalance
+import repository
+from auth import AuthService
+from database import LinkOrm
+from repository import LinkRepository
+from schemas import SLinkAdd, UserRegister
+from sharding import ShardRouter
+
+
+@pytest.fixture
+def make_shards(tmp_path, monkeypatch):
+    """
+    Шарды на временных файлах SQLite.
+    Без пула соединений движки не привязаны к циклу событий конкретного теста.
+    """
+    def make(count: int, fallback: bool = False) -> ShardRouter:
+        urls = [f"sqlite+aiosqlite:///{tmp_path}/links_{i}.db" for i in range(count)]
+        router = ShardRouter.from_urls(urls, fallback=fallback, poolclass=NullPool)
+        for module in (database, repository, rebalance):
+            monkeypatch.setattr(module, "link_shards", router)
+        return router
+
+    return make
+
+
+@pytest.fixture
+def main_db(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/main.db", poolclass=NullPool)
+    new_session = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "new_session", new_session)
+    monkeypatch.setattr(auth, "new_session", new_session)
+    # Фоновая очистка не нужна в тестах и не должна переживать цикл событий теста.
+    monkeypatch.setattr(main, "delete_expired_links", no_background_task)
+
+
+async def no_background_task():
+    pass
+
+
+async def add_links(count: int, user_id=None) -> list:
+    await database.create_link_tables()
+    links = []
+    for i in range(count):
+        data = SLinkAdd(original_url=f"https://example.com/{i}")
+        links.append(await LinkRepository.add_one(data, user_id=user_id))
+    return links
+
+
+async def links_on(shard, *conditions) -> list:
+    async with shard.session() as session:
+        result = await session.execute(select(LinkOrm).where(*conditions))
+        return result.scalars().all()
+
+
+async def user_links(user_id: int) -> list:
+    found = await repository.link_shards.gather(lambda shard: links_on(shard, LinkOrm.user_id == user_id))
+    return [link for links in found for link in links]
+
+
+def moving_links(links, router):
+    return [link for link in links if router.shard_for(link.short_code).index == 2]
+
+
+def alias_moving_to_last_shard(router: ShardRouter) -> str:
+    while True:
+        alias = LinkRepository.generate_short_code()
+        if router.shard_for(alias).index == 2:
+            return alias
+
+
+def test_appended_shard_only_takes_links():
+    codes = [LinkRepository.generate_short_code() for _ in range(1000)]
+    two = ShardRouter([object(), object()])
+    three = ShardRouter([object(), object(), object()])
+
+    moved = [code for code in codes if two.shard_for(code).index != three.shard_for(code).index]
+
+    assert moved
+    assert all(three.shard_for(code).index == 2 for code in moved)
+
+
+def test_reads_and_fan_outs(make_shards):
+    router = make_shards(2)
+
+    async def scenario():
+        links = await add_links(20)
+        link = links[0]
+
+        shard, found = await LinkRepository.locate(link.short_code)
+        assert found.short_code == link.short_code
+        assert shard is router.shard_for(link.short_code)
+
+        by_url = await LinkRepository.find_by_original_url("https://example.com/7")
+        assert by_url.short_code == links[7].short_code
+
+        counts = [len(await links_on(shard)) for shard in router.shards]
+        assert sum(counts) == 20 and all(counts)
+
+    asyncio.run(scenario())
+
+
+def test_restart_keeps_users_and_links_together(make_shards, main_db, monkeypatch):
+    make_shards(2)
+    monkeypatch.setattr(main, "RESET_TABLES", False)
+
+    async def scenario():
+        async with main.lifespan(main.app):
+            alice = await AuthService.register_user(UserRegister(username="alice", password="secret1"))
+            await add_links(3, user_id=alice.id)
+
+        async with main.lifespan(main.app):
+            bob = await AuthService.register_user(UserRegister(username="bob", password="secret2"))
+            assert bob.id != alice.id
+            assert await user_links(bob.id) == []
+            assert len(await user_links(alice.id)) == 3
+
+    asyncio.run(scenario())
+
+
+def test_reset_clears_users_and_links_together(make_shards, main_db, monkeypatch):
+    make_shards(2)
+    monkeypatch.setattr(main, "RESET_TABLES", True)
+
+    async def scenario():
+        async with main.lifespan(main.app):
+            alice = await AuthService.register_user(UserRegister(username="alice", password="secret1"))
+            await add_links(3, user_id=alice.id)
+
+        async with main.lifespan(main.app):
+            bob = await AuthService.register_user(UserRegister(username="bob", password="secret2"))
+            assert bob.id == alice.id
+            assert await user_links(bob.id) == []
+
+    asyncio.run(scenario())
+
+
+def test_rebalance_moves_links_and_is_idempotent(make_shards):
+    make_shards(2)
+
+    async def scenario():
+        links = await add_links(30)
+        await LinkRepository.increment_click_count(*await LinkRepository.locate(links[0].short_code))
+
+        router = make_shards(3, fallback=True)
+        assert await rebalance.rebalance_links() > 0
+        assert await rebalance.rebalance_links() == 0
+
+        for link in links:
+            shard, found = await LinkRepository.locate(link.short_code)
+            assert shard is router.shard_for(link.short_code)
+            assert found.original_url == str(link.original_url)
+        _, first = await LinkRepository.locate(links[0].short_code)
+        assert first.click_count == 1
+        assert sum([len(await links_on(shard)) for shard in router.shards]) == 30
+
+    asyncio.run(scenario())
+
+
+def test_lookup_during_move_finds_copy(make_shards, monkeypatch):
+    two = make_shards(2)
+    alias = alias_moving_to_last_shard(ShardRouter([object(), object(), object()]))
+    source_index = two.shard_for(alias).index
+
+    async def scenario():
+        await database.create_link_tables()
+        await LinkRepository.add_one(SLinkAdd(original_url="https://example.com/alias", custom_alias=alias))
+
+        router = make_shards(3, fallback=True)
+        await database.create_link_tables()
+        source, target = router.shards[source_index], router.shards[2]
+        get_from_shard = LinkRepository._get_from_shard
+        moved = False
+
+        async def move_before_source_read(shard, short_code):
+            # Перенос завершается между чтением шардов одного поиска.
+            nonlocal moved
+            if shard is source and not moved:
+                moved = True
+                link = await get_from_shard(source, alias)
+                assert await rebalance.move_link(source, target, link)
+            return await get_from_shard(shard, short_code)
+
+        monkeypatch.setattr(LinkRepository, "_get_from_shard", staticmethod(move_before_source_read))
+
+        shard, found = await LinkRepository.locate(alias)
+        assert moved
+        assert shard is target and found.short_code == alias
+
+        with pytest.raises(HTTPException) as error:
+            await LinkRepository.add_one(SLinkAdd(original_url="https://example.com/other", custom_alias=alias))
+        assert error.value.status_code == 400
+        assert len(await links_on(target, LinkOrm.short_code == alias)) == 1
+
+    asyncio.run(scenario())
+
+
+def test_rebalance_keeps_writes_made_during_copy(make_shards, monkeypatch):
+    make_shards(2)
+
+    async def scenario():
+        links = await add_links(30)
+        router = make_shards(3, fallback=True)
+        clicked, deleted = moving_links(links, router)[:2]
+        write_copy = rebalance.write_copy
+
+        async def write_copy_with_traffic(target, link):
+            if link.short_code == clicked.short_code and link.click_count == 0:
+                await LinkRepository.increment_click_count(*await LinkRepository.locate(link.short_code))
+            if link.short_code == deleted.short_code:
+                await LinkRepository.delete_by_short_code(link.short_code, None)
+            await write_copy(target, link)
+
+        monkeypatch.setattr(rebalance, "write_copy", write_copy_with_traffic)
+        await rebalance.rebalance_links()
+
+        shard, found = await LinkRepository.locate(clicked.short_code)
+        assert shard is router.shard_for(clicked.short_code)
+        assert found.click_count == 1
+        assert await LinkRepository.find_by_short_code(deleted.short_code) is None
+
+    asyncio.run(scenario())
+
+
+def test_rebalance_drops_copy_of_link_deleted_after_copy(make_shards, monkeypatch):
+    make_shards(2)
+
+    async def scenario():
+        links = await add_links(30)
+        router = make_shards(3, fallback=True)
+        deleted = moving_links(links, router)[0]
+        write_copy = rebalance.write_copy
+
+        async def write_copy_then_delete(target, link):
+            await write_copy(target, link)
+            if link.short_code == deleted.short_code:
+                # Пока оригинал не удален, сервис работает с ним, а не с копией.
+                shard, _ = await LinkRepository.locate(link.short_code)
+                assert shard is not target
+                await LinkRepository.delete_by_short_code(link.short_code, None)
+
+        monkeypatch.setattr(rebalance, "write_copy", write_copy_then_delete)
+        await rebalance.rebalance_links()
+
+        assert await LinkRepository.find_by_short_code(deleted.short_code) is None
+
+    asyncio.run(scenario())
+
+
+def test_rebalance_skips_link_that_keeps_changing(make_shards, monkeypatch):
+    make_shards(2)
+    monkeypatch.setattr(rebalance, "MOVE_BACKOFF", 0)
+
+    async def scenario():
+        links = await add_links(30)
+        router = make_shards(3, fallback=True)
+        hot = moving_links(links, router)[0]
+        write_copy = rebalance.write_copy
+        copies = 0
+
+        async def write_copy_under_clicks(target, link):
+            nonlocal copies
+            await write_copy(target, link)
+            if link.short_code == hot.short_code:
+                copies += 1
+                await LinkRepository.increment_click_count(*await LinkRepository.locate(link.short_code))
+
+        monkeypatch.setattr(rebalance, "write_copy", write_copy_under_clicks)
+        moved = await rebalance.rebalance_links()
+
+        assert copies == rebalance.MOVE_ATTEMPTS
+        assert moved == len(moving_links(links, router)) - 1
+        shard, found = await LinkRepository.locate(hot.short_code)
+        assert shard is not router.shards[2]
+        assert found.click_count == rebalance.MOVE_ATTEMPTS
+
+        monkeypatch.setattr(rebalance, "write_copy", write_copy)
+        assert await rebalance.rebalance_links() == 1
+        shard, found = await LinkRepository.locate(hot.short_code)
+        assert shard is router.shards[2]
+        assert found.click_count == rebalance.MOVE_ATTEMPTS
+
+    asyncio.run(scenario())
+
+
+def test_rerun_replaces_stale_copy(make_shards):
+    make_shards(2)
+
+    async def scenario():
+        links = await add_links(30)
+        router = make_shards(3, fallback=True)
+        link = moving_links(links, router)[0]
+        await database.create_link_tables()
+
+        # Копия осталась от прерванного переноса, после чего оригинал изменился.
+        _, stale = await LinkRepository.locate(link.short_code)
+        await rebalance.write_copy(router.shards[2], stale)
+        await LinkRepository.increment_click_count(*await LinkRepository.locate(link.short_code))
+
+        await rebalance.rebalance_links()
+
+        shard, found = await LinkRepository.locate(link.short_code)
+        assert shard is router.shards[2]
+        assert found.click_count == 1
+        assert len(await links_on(router.shards[2])) == len(moving_links(links, router))
+
+    asyncio.run(scenario())
+
+
+def test_rebalance_refuses_to_overwrite_other_link(make_shards):
+    make_shards(2)
+
+    async def scenario():
+        links = await add_links(30)
+        router = make_shards(3, fallback=True)
+        link = moving_links(links, router)[0]
+        await database.create_link_tables()
+
+        async with router.shards[2].session() as session:
+            session.add(LinkOrm(original_url="https://example.com/other", short_code=link.short_code))
+            await session.commit()
+
+        with pytest.raises(RuntimeError):
+            await rebalance.rebalance_links()
+
+        others = await links_on(router.shards[2], LinkOrm.short_code == link.short_code)
+        assert [other.original_url for other in others] == ["https://example.com/other"]
+        originals = await links_on(router.shards[0], LinkOrm.short_code == link.short_code)
+        originals += await links_on(router.shards[1], LinkOrm.short_code == link.short_code)
+        assert [original.original_url for original in originals] == [str(link.original_url)]
+
+    asyncio.run(scenario())